@@ -1,6 +1,774 @@
+#!/usr/bin/env python3
+"""
+Glitch DD - CLI Edition
+=======================
+Writes ISO / IMG files to USB sticks and other block devices.
+
+  - O_DIRECT writes from page-aligned buffers (no page-cache pollution)
+  - Reader and writer threads hand buffers back and forth (double-buffered)
+  - Periodic fdatasync so progress reflects what reached the device
+  - Progress with rate and ETA
+  - Optional read-back verification with SHA-256
+  - Several targets at once: the image is read once into a shared ring
+    buffer and every device gets its own writer, progress and verify pass
+  - Sparse-aware: with IMAGE.bmap (bmaptool format) only mapped ranges
+    are copied and verified
+
+Usage:
+  sudo python3 DD-CLI.py glitch-live.iso /dev/sdX --verify
+  python3 DD-CLI.py glitch-live.iso /tmp/test.img          (regular files work too)
+  sudo python3 DD-CLI.py glitch-live.iso /dev/sdb /dev/sdc --verify
+  sudo python3 DD-CLI.py                                   (install and launch the packaged DD tool)
+"""
+
+import sys
+import os
+import re
+import stat
+import time
+import mmap
+import fcntl
+import queue
+import hashlib
+import argparse
+import threading
+import subprocess
+import xml.etree.ElementTree as ET
+
+# ---------------------------------------------------------------
+# ANSI COLORS
+# ---------------------------------------------------------------
+class C:
+    RESET   = "\033[0m"
+    BOLD    = "\033[1m"
+    RED     = "\033[91m"
+    GREEN   = "\033[92m"
+    YELLOW  = "\033[93m"
+    BLUE    = "\033[94m"
+    CYAN    = "\033[96m"
+    DIM     = "\033[2m"
+
+# ---------------------------------------------------------------
+# PACKAGED DD TOOL (previous behaviour, used when run without arguments)
+# ---------------------------------------------------------------
+BOOTSTRAP_SCRIPT = r"""
 cd /tmp
 sudo apt update && sudo apt install -y python3 python3-pip git pv dosfstools parted cryptsetup util-linux
 sudo wget https://github.com/GlitchLinux/dd_py_CLI/releases/download/dd-cli_v0.1/dd-cli_v0.1_amd64.deb
 sudo dpkg -i dd-cli_v0.1_amd64.deb
 sudo rm dd-cli_v0.1_amd64.deb
 bash -i -c "DD"
+"""
+
+DEFAULT_BS = 4 * 1024**2
+DEFAULT_SYNC = 256 * 1024**2
+ALIGN = 4096              # buffer / O_DIRECT alignment (covers 512e and 4Kn devices)
+BLKGETSIZE64 = 0x80081272
+BLKRRPART = 0x125F
+
+
+# ---------------------------------------------------------------
+# UTILITY FUNCTIONS
+# ---------------------------------------------------------------
+def log_info(msg):
+    print(f"{C.DIM}[INFO]{C.RESET}  {msg}")
+
+def log_ok(msg):
+    print(f"{C.GREEN}[ OK ]{C.RESET}  {msg}")
+
+def log_warn(msg):
+    print(f"{C.YELLOW}[WARN]{C.RESET}  {msg}")
+
+def log_err(msg):
+    print(f"{C.RED}[ ERR]{C.RESET}  {msg}", file=sys.stderr)
+
+
+def human_size(size_bytes):
+    """Convert bytes to human-readable size."""
+    if size_bytes is None:
+        return "Unknown"
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(size_bytes) < 1024.0:
+            return f"{size_bytes:.1f} {unit}"
+        size_bytes /= 1024.0
+    return f"{size_bytes:.1f} PB"
+
+
+def parse_size(text):
+    """'4M' -> 4194304. Accepts K/M/G suffixes (powers of 1024)."""
+    m = re.match(r'^\s*(\d+(?:\.\d+)?)\s*([KMG]?)i?B?\s*$', str(text), re.IGNORECASE)
+    if not m:
+        raise ValueError(f"invalid size: {text}")
+    return int(float(m.group(1)) * 1024 ** " KMG".index(m.group(2).upper() or " "))
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def confirm(prompt):
+    """Ask y/n confirmation. Returns True if yes."""
+    while True:
+        resp = input(f"{C.BOLD}{prompt} [y/N]: {C.RESET}").strip().lower()
+        if resp in ("y", "yes"):
+            return True
+        if resp in ("n", "no", ""):
+            return False
+
+
+def device_size(fd):
+    """Size of an open block device or file in bytes."""
+    st = os.fstat(fd)
+    if stat.S_ISBLK(st.st_mode):
+        buf = fcntl.ioctl(fd, BLKGETSIZE64, b"\0" * 8)
+        return int.from_bytes(buf, sys.byteorder)
+    return st.st_size
+
+
+def mounted_partitions(device):
+    """Mount points that live on device or one of its partitions."""
+    real = os.path.realpath(device)
+    found = []
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                src, mnt = line.split()[:2]
+                if not src.startswith("/dev/"):
+                    continue
+                src_real = os.path.realpath(src)
+                if src_real == real or (src_real.startswith(real)
+                                        and re.fullmatch(r'p?\d+', src_real[len(real):])):
+                    found.append((src, mnt.replace("\\040", " ")))
+    except OSError:
+        pass
+    return found
+
+
+def aligned_buffer(size):
+    """Anonymous mmap: page-aligned, as O_DIRECT requires."""
+    return mmap.mmap(-1, size)
+
+
+def open_direct(path, flags):
+    """Open with O_DIRECT, falling back to buffered I/O where unsupported (tmpfs)."""
+    try:
+        return os.open(path, flags | os.O_DIRECT), True
+    except OSError:
+        return os.open(path, flags), False
+
+
+def target_flags(target):
+    """Open flags for a write target. Regular files are truncated, so ranges a
+    block map skips read back as zeroes rather than as the file's old bytes."""
+    if not os.path.exists(target):
+        return os.O_WRONLY | os.O_CREAT
+    if stat.S_ISREG(os.stat(target).st_mode):
+        return os.O_WRONLY | os.O_TRUNC
+    return os.O_WRONLY
+
+
+def set_direct(fd, enabled):
+    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_DIRECT if enabled else fl & ~os.O_DIRECT)
+
+
+def read_full(fd, buf, size, offset):
+    """Fill buf[:size] from fd at offset; returns the bytes read (short only at EOF)."""
+    got = 0
+    with memoryview(buf) as view:
+        while got < size:
+            n = os.preadv(fd, [view[got:size]], offset + got)
+            if n == 0:
+                break
+            got += n
+    return got
+
+
+def write_full(fd, buf, n, direct, offset):
+    """Write buf[:n] at offset. An unaligned tail is written with O_DIRECT switched off."""
+    aligned = n - n % ALIGN if direct else n
+    with memoryview(buf) as view:
+        done = 0
+        while done < aligned:
+            done += os.pwrite(fd, view[done:aligned], offset + done)
+        if aligned < n:
+            set_direct(fd, False)
+            try:
+                while done < n:
+                    done += os.pwrite(fd, view[done:n], offset + done)
+            finally:
+                set_direct(fd, True)
+
+
+# ---------------------------------------------------------------
+# BLOCK MAP (bmap)
+# ---------------------------------------------------------------
+# A .bmap file (bmaptool XML, as written next to ISOs by the Live System
+# Builder) lists the block ranges that hold data. Only those are copied and
+# verified; everything else on the target is left as it is.
+def load_bmap(path):
+    """Parse a bmap file. Returns (image_size, checksum_type, [(start, end, checksum)])."""
+    with open(path) as f:
+        text = f.read()
+    root = ET.fromstring(text)
+    if root.tag != "bmap":
+        raise ValueError(f"{path} is not a bmap file")
+    major = int(root.get("version", "1.0").split(".")[0])
+    field = lambda tag: (root.findtext(tag) or "").strip()
+    image_size, block = int(field("ImageSize")), int(field("BlockSize"))
+    algo = field("ChecksumType") or "sha1"
+
+    stored = field("BmapFileChecksum")
+    if major >= 2 and stored:
+        # Taken over the file with the checksum itself replaced by zeroes
+        zeroed = text.replace(stored, "0" * len(stored), 1)
+        if hashlib.new(algo, zeroed.encode()).hexdigest() != stored:
+            raise ValueError(f"{path}: bmap file checksum mismatch (file corrupted?)")
+
+    ranges = []
+    for rng in root.iter("Range"):
+        first, _, last = rng.text.strip().partition("-")
+        first = int(first)
+        last = int(last) if last else first
+        ranges.append((first * block, min((last + 1) * block, image_size), rng.get("chksum")))
+    return image_size, algo, ranges
+
+
+def iter_chunks(ranges, bs):
+    """(range_index, offset, length) in image order, at most bs long, range-aligned."""
+    for idx, (start, end, _) in enumerate(ranges):
+        offset = start
+        while offset < end:
+            n = min(bs, end - offset)
+            yield idx, offset, n
+            offset += n
+
+
+class RangeHasher:
+    """Per-range digests of a stream of chunks, checked against expected values."""
+
+    def __init__(self, ranges, algo="sha256", what="image"):
+        self.ranges = ranges
+        self.algo = algo
+        self.what = what
+        self.digests = [None] * len(ranges)
+        self.current, self.hash = None, None
+
+    def update(self, idx, offset, view):
+        if idx != self.current:
+            self.current, self.hash = idx, hashlib.new(self.algo)
+        self.hash.update(view)
+        start, end, expected = self.ranges[idx]
+        if offset + len(view) == end:
+            self.digests[idx] = self.hash.hexdigest()
+            if expected and self.digests[idx] != expected:
+                raise IOError(f"{self.what} does not match the bmap at bytes {start}-{end}")
+
+
+# ---------------------------------------------------------------
+# PROGRESS
+# ---------------------------------------------------------------
+class Progress:
+    """One-line progress with rate and ETA, redrawn at most twice a second."""
+
+    def __init__(self, label, total):
+        self.label = label
+        self.total = total
+        self.t0 = time.time()
+        self.last = 0.0
+
+    def update(self, done, force=False):
+        now = time.time()
+        if not force and now - self.last < 0.5:
+            return
+        self.last = now
+        elapsed = max(now - self.t0, 1e-6)
+        rate = done / elapsed
+        pct = 100.0 * done / self.total if self.total else 100.0
+        eta = format_eta((self.total - done) / rate) if rate > 0 else "--:--:--"
+        sys.stdout.write(f"\r  {self.label:<8} {human_size(done):>10} / {human_size(self.total):<10} "
+                         f"{pct:5.1f}%  {human_size(rate):>10}/s  ETA {eta} ")
+        sys.stdout.flush()
+
+    def finish(self, done):
+        self.update(done, force=True)
+        sys.stdout.write("\n")
+        return time.time() - self.t0
+
+
+# ---------------------------------------------------------------
+# WRITE ENGINE
+# ---------------------------------------------------------------
+def write_image(image, target, ranges, bs=DEFAULT_BS, sync_every=DEFAULT_SYNC, buffers=2,
+                algo="sha256"):
+    """Copy the given byte ranges of image to target.
+
+    Returns (bytes_written, per-range digests, seconds). A reader thread fills
+    free buffers while the main thread writes the previous one, so reading
+    the image and writing the device overlap.
+    """
+    size = os.path.getsize(image)
+    total = sum(end - start for start, end, _ in ranges)
+    src = os.open(image, os.O_RDONLY)
+    flags = target_flags(target)
+    dst, direct = open_direct(target, flags)
+    if not direct:
+        log_warn("O_DIRECT not supported on target - using buffered writes")
+
+    free, full = queue.Queue(), queue.Queue()
+    for _ in range(buffers):
+        free.put(aligned_buffer(bs))
+    hasher = RangeHasher(ranges, algo)
+    failure = []
+    stop = threading.Event()
+
+    def reader():
+        try:
+            for idx, offset, want in iter_chunks(ranges, bs):
+                buf = free.get()
+                if buf is None or stop.is_set():
+                    break
+                n = read_full(src, buf, want, offset)
+                if n < want:
+                    raise IOError(f"unexpected end of {image} at {offset + n}")
+                with memoryview(buf) as view:
+                    hasher.update(idx, offset, view[:n])
+                full.put((buf, n, offset))
+        except Exception as e:
+            failure.append(e)
+        finally:
+            full.put(None)
+
+    thread = threading.Thread(target=reader, daemon=True)
+    progress = Progress("write", total)
+    written = synced = 0
+    thread.start()
+    try:
+        while True:
+            item = full.get()
+            if item is None:
+                break
+            buf, n, offset = item
+            write_full(dst, buf, n, direct, offset)
+            free.put(buf)
+            written += n
+            if written - synced >= sync_every:
+                os.fdatasync(dst)
+                synced = written
+            progress.update(written)
+        if failure:
+            raise failure[0]
+        if not stat.S_ISBLK(os.fstat(dst).st_mode):
+            os.ftruncate(dst, size)
+        os.fdatasync(dst)
+    finally:
+        stop.set()
+        free.put(None)
+        thread.join(timeout=5)
+        os.close(src)
+        os.close(dst)
+    elapsed = progress.finish(written)
+    return written, hasher.digests, elapsed
+
+
+def hash_target(target, ranges, bs=DEFAULT_BS, algo="sha256", on_progress=None):
+    """Per-range digests of target, read around the page cache.
+
+    on_progress(done) replaces the progress line (used for multi-target writes).
+    """
+    fd, direct = open_direct(target, os.O_RDONLY)
+    if not direct:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    buf = aligned_buffer(bs)
+    hasher = RangeHasher([(start, end, None) for start, end, _ in ranges], algo)
+    total = sum(end - start for start, end, _ in ranges)
+    progress = Progress("verify", total) if on_progress is None else None
+    done = 0
+    try:
+        for idx, offset, want in iter_chunks(ranges, bs):
+            # O_DIRECT reads must be whole blocks; hash only what belongs to the image
+            n = read_full(fd, buf, -(-want // ALIGN) * ALIGN if direct else want, offset)
+            if n < want:
+                raise IOError(f"short read from {target} at {offset + n}")
+            with memoryview(buf) as view:
+                hasher.update(idx, offset, view[:want])
+            done += want
+            if progress:
+                progress.update(done)
+            else:
+                on_progress(done)
+    finally:
+        os.close(fd)
+        buf.close()
+    if progress:
+        progress.finish(done)
+    return hasher.digests
+
+
+def reread_partitions(target):
+    """Ask the kernel to pick up the new partition table."""
+    try:
+        fd = os.open(target, os.O_RDONLY)
+        try:
+            fcntl.ioctl(fd, BLKRRPART)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
+def check_target(image, target):
+    """Refuse obviously wrong targets. Returns an error string or None."""
+    if not os.path.isfile(image):
+        return f"Image not found: {image}"
+    if os.path.exists(target):
+        st = os.stat(target)
+        if stat.S_ISBLK(st.st_mode):
+            mounts = mounted_partitions(target)
+            if mounts:
+                return f"{target} is mounted ({', '.join(m for _, m in mounts)}) - unmount it first"
+            fd = os.open(target, os.O_RDONLY)
+            try:
+                capacity = device_size(fd)
+            finally:
+                os.close(fd)
+            if capacity < os.path.getsize(image):
+                return f"{target} ({human_size(capacity)}) is smaller than the image"
+        elif not stat.S_ISREG(st.st_mode):
+            return f"{target} is not a block device or regular file"
+    return None
+
+
+# ---------------------------------------------------------------
+# MULTI-TARGET WRITES
+# ---------------------------------------------------------------
+class RingBuffer:
+    """Image blocks read once and shared by every target writer.
+
+    A slot is refilled only after every still-active writer has written it,
+    so a slow stick holds the others back by at most the ring's size, and a
+    failed stick is dropped without stopping the rest.
+    """
+
+    def __init__(self, slots, bs, writers):
+        self.bufs = [aligned_buffer(bs) for _ in range(slots)]
+        self.chunks = [None] * slots     # (length, offset) per slot
+        self.produced = 0
+        self.eof = False
+        self.error = None
+        self.digests = None
+        self.next_seq = {w: 0 for w in writers}
+        self.cond = threading.Condition()
+
+    def _low_water(self):
+        return min(self.next_seq.values()) if self.next_seq else self.produced
+
+    def fill(self, src, ranges, algo="sha256"):
+        """Reader: stream the image ranges into the ring."""
+        hasher = RangeHasher(ranges, algo)
+        slots = len(self.bufs)
+        try:
+            for idx, offset, want in iter_chunks(ranges, len(self.bufs[0])):
+                with self.cond:
+                    while self.produced - self._low_water() >= slots and self.next_seq:
+                        self.cond.wait()
+                    if not self.next_seq:
+                        return      # every target failed
+                    slot = self.produced % slots
+                n = read_full(src, self.bufs[slot], want, offset)
+                if n < want:
+                    raise IOError(f"unexpected end of image at {offset + n}")
+                with memoryview(self.bufs[slot]) as view:
+                    hasher.update(idx, offset, view[:n])
+                with self.cond:
+                    self.chunks[slot] = (n, offset)
+                    self.produced += 1
+                    self.cond.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.cond:
+                self.digests = hasher.digests if self.error is None else None
+                self.eof = True
+                self.cond.notify_all()
+
+    def get(self, writer):
+        """Next (buffer, length, offset) for writer, or None at the end of the image."""
+        with self.cond:
+            seq = self.next_seq[writer]
+            while seq >= self.produced and not self.eof:
+                self.cond.wait()
+            if seq >= self.produced:
+                if self.error:
+                    raise IOError(f"reading the image failed: {self.error}")
+                return None
+            slot = seq % len(self.bufs)
+            return (self.bufs[slot],) + self.chunks[slot]
+
+    def release(self, writer):
+        with self.cond:
+            self.next_seq[writer] += 1
+            self.cond.notify_all()
+
+    def drop(self, writer):
+        with self.cond:
+            self.next_seq.pop(writer, None)
+            self.cond.notify_all()
+
+
+def _target_writer(ring, status, ranges, size, sync_every, verify, bs, algo):
+    """Writer thread for one target; failures stay in this target's status."""
+    target = status["target"]
+    status["t0"] = time.time()
+    try:
+        flags = target_flags(target)
+        dst, direct = open_direct(target, flags)
+        try:
+            synced = 0
+            while True:
+                item = ring.get(target)
+                if item is None:
+                    break
+                buf, n, offset = item
+                write_full(dst, buf, n, direct, offset)
+                ring.release(target)
+                status["done"] += n
+                if status["done"] - synced >= sync_every:
+                    os.fdatasync(dst)
+                    synced = status["done"]
+            if not stat.S_ISBLK(os.fstat(dst).st_mode):
+                os.ftruncate(dst, size)
+            os.fdatasync(dst)
+        finally:
+            ring.drop(target)
+            os.close(dst)
+        status["write_s"] = time.time() - status["t0"]
+
+        if verify:
+            status["state"] = "verify"
+            status["done"] = 0
+            got = hash_target(target, ranges, bs, algo,
+                              on_progress=lambda d: status.__setitem__("done", d))
+            bad = [ranges[i] for i, d in enumerate(got) if d != ring.digests[i]]
+            if bad:
+                raise IOError(f"verify mismatch in {len(bad)} range(s), first at byte {bad[0][0]}")
+        status["state"] = "done"
+        if stat.S_ISBLK(os.stat(target).st_mode):
+            reread_partitions(target)
+    except Exception as e:
+        ring.drop(target)
+        status["state"] = "FAILED"
+        status["error"] = str(e)
+    status["elapsed"] = time.time() - status["t0"]
+
+
+def _draw_status(statuses, size, first):
+    """Redraw one line per target in place."""
+    lines = []
+    for st in statuses:
+        elapsed = max(time.time() - st["t0"], 1e-6) if st.get("t0") else 1e-6
+        rate = st["done"] / elapsed if st["state"] in ("write", "verify") else 0
+        pct = 100.0 * st["done"] / size if size else 100.0
+        colour = {"done": C.GREEN, "FAILED": C.RED}.get(st["state"], "")
+        detail = st.get("error") or (f"{human_size(rate)}/s" if rate else "")
+        lines.append(f"  {st['target']:<14} {colour}{st['state']:<7}{C.RESET} {pct:5.1f}%  {detail}")
+    if not first:
+        sys.stdout.write(f"\033[{len(lines)}F")
+    sys.stdout.write("".join(f"\033[2K{line}\n" for line in lines))
+    sys.stdout.flush()
+
+
+def write_many(image, targets, ranges, bs=DEFAULT_BS, sync_every=DEFAULT_SYNC, slots=16,
+               verify=False, algo="sha256"):
+    """Write image ranges to every target at once from a shared ring buffer.
+
+    Returns (per-target status list, per-range digests or None, seconds).
+    """
+    size = os.path.getsize(image)
+    total = sum(end - start for start, end, _ in ranges)
+    ring = RingBuffer(slots, bs, targets)
+    statuses = [{"target": t, "state": "write", "done": 0} for t in targets]
+    src = os.open(image, os.O_RDONLY)
+    t0 = time.time()
+    reader = threading.Thread(target=ring.fill, args=(src, ranges, algo), daemon=True)
+    writers = [threading.Thread(target=_target_writer, daemon=True,
+                                args=(ring, st, ranges, size, sync_every, verify, bs, algo))
+               for st in statuses]
+    reader.start()
+    for w in writers:
+        w.start()
+    try:
+        first = True
+        while any(w.is_alive() for w in writers):
+            _draw_status(statuses, total, first)
+            first = False
+            time.sleep(0.5)
+        _draw_status(statuses, total, first)
+    finally:
+        reader.join(timeout=5)
+        os.close(src)
+    return statuses, ring.digests, time.time() - t0
+
+
+# ---------------------------------------------------------------
+# ENTRY POINT
+# ---------------------------------------------------------------
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        description="Glitch DD - write an ISO/IMG to a USB stick or block device",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog=(
+            "Examples:\n"
+            "  sudo python3 DD-CLI.py glitch-live.iso /dev/sdb --verify\n"
+            "  sudo python3 DD-CLI.py image.img /dev/loop0 --bs 8M --sync-every 1G -y\n"
+            "  sudo python3 DD-CLI.py glitch-live.iso /dev/sdb /dev/sdc /dev/sdd --verify\n"
+            "  python3 DD-CLI.py                      (launch the packaged DD tool)\n"
+        )
+    )
+    parser.add_argument("image", help="ISO / IMG file to write")
+    parser.add_argument("targets", nargs="+", metavar="target",
+                        help="Block device (/dev/sdX) or file; several targets are written at once")
+    parser.add_argument("--bs", default="4M",
+                        help="Block size, rounded up to 4K (default: 4M)")
+    parser.add_argument("--sync-every", default="256M",
+                        help="fdatasync after this many bytes (default: 256M)")
+    parser.add_argument("--buffers", type=int, default=2,
+                        help="Buffers shared between reader and writer (default: 2)")
+    parser.add_argument("--ring", type=int, default=16,
+                        help="Blocks buffered between the image and the slowest of several "
+                             "targets (default: 16)")
+    parser.add_argument("--bmap",
+                        help="Block map: copy and verify only the mapped ranges "
+                             "(default: IMAGE.bmap if it exists)")
+    parser.add_argument("--no-bmap", action="store_true",
+                        help="Copy every byte even if IMAGE.bmap exists")
+    parser.add_argument("--verify", action="store_true",
+                        help="Read the target back and compare checksums with the image")
+    parser.add_argument("--sha256", help="Expected SHA-256 of the image")
+    parser.add_argument("-y", "--yes", action="store_true", help="Don't ask for confirmation")
+    return parser
+
+
+def image_hash_check(args, digests, bmap_used):
+    """Report the image SHA-256 and compare it with --sha256. Returns False on mismatch."""
+    if bmap_used or not digests:
+        if args.sha256:
+            log_warn("--sha256 is only checked for full copies; the bmap checksums were used instead")
+        return True
+    log_info(f"SHA-256: {digests[0]}")
+    if args.sha256 and args.sha256.lower() != digests[0]:
+        log_err(f"Image SHA-256 does not match the expected {args.sha256}")
+        return False
+    return True
+
+
+def flash_many(args, targets, ranges, algo, bs, sync_every, bmap_used):
+    """Multi-target write; returns the exit code (0 only if every target succeeded)."""
+    statuses, digests, elapsed = write_many(args.image, targets, ranges, bs, sync_every,
+                                            max(2, args.ring), args.verify, algo)
+    failed = [st for st in statuses if st["state"] != "done"]
+    print()
+    for st in statuses:
+        if st["state"] == "done":
+            log_ok(f"{st['target']}: written in {st['write_s']:.1f}s"
+                   f"{', verified' if args.verify else ''}")
+        else:
+            log_err(f"{st['target']}: {st.get('error', 'failed')}")
+    slowest = max((st.get("elapsed", 0) for st in statuses), default=0)
+    log_info(f"{len(statuses) - len(failed)}/{len(statuses)} targets OK in {elapsed:.1f}s "
+             f"(slowest target {slowest:.1f}s)")
+    if not image_hash_check(args, digests, bmap_used):
+        return 1
+    return 1 if failed else 0
+
+
+def main():
+    if len(sys.argv) == 1:
+        sys.exit(subprocess.call(["bash", "-c", BOOTSTRAP_SCRIPT]))
+
+    args = build_arg_parser().parse_args()
+    try:
+        bs = -(-parse_size(args.bs) // ALIGN) * ALIGN
+        sync_every = parse_size(args.sync_every)
+    except ValueError as e:
+        log_err(str(e))
+        sys.exit(1)
+
+    targets = list(dict.fromkeys(args.targets))
+    for target in targets:
+        error = check_target(args.image, target)
+        if error:
+            log_err(error)
+            sys.exit(1)
+    devices = [t for t in targets if os.path.exists(t) and stat.S_ISBLK(os.stat(t).st_mode)]
+    if devices and os.geteuid() != 0:
+        log_err("Writing to a block device requires root: sudo python3 DD-CLI.py ...")
+        sys.exit(1)
+
+    size = os.path.getsize(args.image)
+    bmap_path = args.bmap
+    if bmap_path is None and not args.no_bmap and os.path.isfile(args.image + ".bmap"):
+        bmap_path = args.image + ".bmap"
+    ranges, algo = [(0, size, None)], "sha256"
+    if bmap_path:
+        try:
+            bmap_size, algo, ranges = load_bmap(bmap_path)
+        except (OSError, ValueError, ET.ParseError) as e:
+            log_err(f"Cannot use bmap {bmap_path}: {e}")
+            sys.exit(1)
+        if bmap_size != size:
+            log_err(f"{bmap_path} describes a {bmap_size}-byte image, {args.image} is {size} bytes")
+            sys.exit(1)
+    mapped = sum(end - start for start, end, _ in ranges)
+
+    print(f"\n  Image : {args.image} ({human_size(size)})")
+    if bmap_path:
+        print(f"  Bmap  : {bmap_path} ({human_size(mapped)} mapped, "
+              f"{100.0 * mapped / size if size else 0:.0f}%)")
+    for target in targets:
+        print(f"  Target: {target}{' (block device)' if target in devices else ''}")
+    print(f"  Block : {human_size(bs)}, fdatasync every {human_size(sync_every)}\n")
+    if devices and not args.yes:
+        if not confirm(f"ALL DATA on {', '.join(devices)} will be destroyed. Continue?"):
+            print("Aborted.")
+            sys.exit(0)
+
+    if len(targets) > 1:
+        sys.exit(flash_many(args, targets, ranges, algo, bs, sync_every, bool(bmap_path)))
+    target = targets[0]
+    is_device = bool(devices)
+
+    try:
+        written, digests, elapsed = write_image(args.image, target, ranges, bs, sync_every,
+                                                max(2, args.buffers), algo)
+    except (OSError, IOError) as e:
+        print()
+        log_err(f"Write failed: {e}")
+        sys.exit(1)
+    log_ok(f"Wrote {human_size(written)} in {elapsed:.1f}s "
+           f"({human_size(written / max(elapsed, 1e-6))}/s)")
+    if not image_hash_check(args, digests, bool(bmap_path)):
+        sys.exit(1)
+
+    if args.verify:
+        try:
+            target_digests = hash_target(target, ranges, bs, algo)
+        except (OSError, IOError) as e:
+            log_err(f"Verify failed: {e}")
+            sys.exit(1)
+        bad = [ranges[i] for i, d in enumerate(target_digests) if d != digests[i]]
+        if bad:
+            log_err(f"VERIFY FAILED: {len(bad)} range(s) differ, first at byte {bad[0][0]}")
+            sys.exit(1)
+        log_ok("Verified: target matches the image.")
+    if is_device:
+        reread_partitions(target)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        print(f"\n{C.YELLOW}Interrupted.{C.RESET}")
+        sys.exit(130)
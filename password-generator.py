@@ -1,43 +1,294 @@
-
-import random
+import os
+import sys
+import math
+import time
 import string
+import hashlib
 import secrets
+import argparse
+import multiprocessing
 
-symbol1 = "!\#¤%&/()=?*^<>|¡@£$€¥{[]±·¸-,:;_`"
+symbol1 = "!\\#¤%&/()=?*^<>|¡@£$€¥{[]±·¸-,:;_`"
 symbol2 = "@€|;[!]<>#·&¿¸/:^()¡¤%-{£*¥=,_±$`}"
-symbol3 = "¡@£$€¥{[]±!&/()=?*^<\|·¸-,:;_`¤%>="
-symbol4 = "¡¸{[]±·_`!\#¤%@£-,:$€¥&/()=?*^<;>|"
+symbol3 = "¡@£$€¥{[]±!&/()=?*^<\\|·¸-,:;_`¤%>="
+symbol4 = "¡¸{[]±·_`!\\#¤%@£-,:$€¥&/()=?*^<;>|"
+
+# Every character above fits in one cp1252 byte, so whole batches can be
+# assembled as bytes with bytes.translate() and decoded once at the end.
+CHARSET = "cp1252"
+
+# Layout of one password: 4 x (2 letters, 2 symbols, a number 10-99)
+GROUP = 6
+LENGTH = 4 * GROUP
+RECORD = LENGTH + 1          # password + newline
+
+DEFAULT_BATCH = 65536
+
+
+def _tables(alphabet):
+    """Translation tables for unbiased byte -> alphabet mapping.
+
+    Bytes >= limit are rejected (deleted) so that b % len(alphabet) is
+    uniform; the rest are mapped straight to the character's cp1252 byte.
+    """
+    n = len(alphabet)
+    limit = 256 - 256 % n
+    encoded = alphabet.encode(CHARSET)
+    table = bytes(encoded[b % n] for b in range(256))
+    return bytes(range(limit, 256)), table
+
+
+LETTERS = _tables(string.ascii_letters)
+SYMBOLS = [_tables(s) for s in (symbol1, symbol2, symbol3, symbol4)]
+# 10-99 is drawn as one of 90 values; tens and ones digits come from the same byte
+NUMBER_REJECT = bytes(range(180, 256))
+TENS = bytes(ord(str((b % 90 + 10) // 10)) for b in range(256))
+ONES = bytes(ord(str((b % 90 + 10) % 10)) for b in range(256))
+
+
+def _accepted(reject, count):
+    """count uniformly usable CSPRNG bytes (rejection sampling, batched)."""
+    keep = (256 - len(reject)) / 256
+    out = b""
+    while len(out) < count:
+        need = count - len(out)
+        out += os.urandom(int(need / keep * 1.05) + 64).translate(None, reject)
+    return out[:count]
+
+
+def generate_batch(count):
+    """Return count passwords as cp1252 bytes, one per line."""
+    out = bytearray(count * RECORD)
+    letters = _accepted(LETTERS[0], 8 * count).translate(LETTERS[1])
+    numbers = _accepted(NUMBER_REJECT, 4 * count)
+    for g in range(4):
+        base = g * GROUP
+        reject, table = SYMBOLS[g]
+        symbols = _accepted(reject, 2 * count).translate(table)
+        for i in range(2):
+            out[base + i::RECORD] = letters[(2 * g + i) * count:(2 * g + i + 1) * count]
+            out[base + 2 + i::RECORD] = symbols[i * count:(i + 1) * count]
+        num = numbers[g * count:(g + 1) * count]
+        out[base + 4::RECORD] = num.translate(TENS)
+        out[base + 5::RECORD] = num.translate(ONES)
+    out[LENGTH::RECORD] = b"\n" * count
+    return bytes(out)
+
+
+def generate(count, stream, batch=DEFAULT_BATCH):
+    """Write count passwords to a binary stream, batch by batch."""
+    done = 0
+    while done < count:
+        n = min(batch, count - done)
+        stream.write(generate_batch(n).decode(CHARSET).encode("utf-8"))
+        done += n
+    stream.flush()
+
+
+class BloomFilter:
+    """Fixed-size duplicate filter: no false negatives, false positives at ~fp_rate.
+
+    A false positive only costs a regenerated candidate, never a duplicate.
+    """
+
+    def __init__(self, capacity, fp_rate):
+        self.capacity = max(1, capacity)
+        self.fp_rate = fp_rate
+        self.m = max(64, math.ceil(-self.capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / self.capacity * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.count = 0
+
+    def add(self, item):
+        """Insert item; return False if it was (probably) already present."""
+        x = int.from_bytes(hashlib.blake2b(item, digest_size=16).digest(), "little")
+        h1, h2 = x & 0xFFFFFFFFFFFFFFFF, (x >> 64) | 1
+        bits, m = self.bits, self.m
+        new = False
+        for i in range(self.k):
+            pos = (h1 + i * h2) % m
+            mask = 1 << (pos & 7)
+            if not bits[pos >> 3] & mask:
+                bits[pos >> 3] |= mask
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def expected_false_positives(self):
+        """Expected candidates wrongly rejected while filling up to capacity."""
+        steps = 1000
+        total = 0.0
+        for j in range(steps):
+            filled = (j + 0.5) / steps * self.capacity
+            total += (1 - math.exp(-self.k * filled / self.m)) ** self.k
+        return total / steps * self.capacity
+
+
+def _shard_of(item, shards):
+    digest = hashlib.blake2b(item, digest_size=8, person=b"shard").digest()
+    return int.from_bytes(digest, "little") % shards
+
+
+def generate_unique(count, stream, fp_rate=1e-6, batch=DEFAULT_BATCH, shard=0, shards=1):
+    """Like generate(), but no password is written twice.
+
+    With shards > 1 only passwords whose hash falls in this shard are kept,
+    so the outputs of all shards are disjoint as well.
+    """
+    bloom = BloomFilter(count, fp_rate)
+    rejected = done = 0
+    while done < count:
+        want = min(batch, count - done)
+        kept = []
+        while len(kept) < want:
+            for pw in generate_batch((want - len(kept)) * shards).split(b"\n")[:-1]:
+                if shards > 1 and _shard_of(pw, shards) != shard:
+                    continue
+                if bloom.add(pw):
+                    kept.append(pw)
+                    if len(kept) == want:
+                        break
+                else:
+                    rejected += 1
+        stream.write((b"\n".join(kept) + b"\n").decode(CHARSET).encode("utf-8"))
+        done += want
+    stream.flush()
+    return {
+        "count": done, "rejected": rejected, "bits": bloom.m, "hashes": bloom.k,
+        "memory": len(bloom.bits), "fp_rate": fp_rate,
+        "expected_rejected": bloom.expected_false_positives(),
+    }
+
+
+def _shard_worker(job):
+    path, count, fp_rate, batch, shard, shards = job
+    with open(path, "wb") as f:
+        if fp_rate:
+            return generate_unique(count, f, fp_rate, batch, shard, shards)
+        generate(count, f, batch)
+        return {"count": count}
+
+
+def shard_paths(output, shards):
+    root, ext = os.path.splitext(output)
+    return [f"{root}-{i + 1:03d}{ext}" for i in range(shards)]
+
+
+def generate_sharded(count, output, shards, fp_rate=None, batch=DEFAULT_BATCH):
+    """Generate across processes into <output>-NNN files. fp_rate enables uniqueness."""
+    paths = shard_paths(output, shards)
+    jobs = [(path, count // shards + (i < count % shards), fp_rate, batch, i, shards)
+            for i, path in enumerate(paths)]
+    with multiprocessing.get_context("fork").Pool(shards) as pool:
+        return paths, pool.map(_shard_worker, jobs)
+
+
+def report(stats_list, elapsed):
+    count = sum(st["count"] for st in stats_list)
+    print(f"{count:,} passwords in {elapsed:.2f}s ({count / elapsed:,.0f}/s)", file=sys.stderr)
+    if "bits" not in stats_list[0]:
+        return
+    st = stats_list[0]
+    rejected = sum(s["rejected"] for s in stats_list)
+    expected = sum(s["expected_rejected"] for s in stats_list)
+    memory = sum(s["memory"] for s in stats_list)
+    print(f"unique: Bloom filter {memory / 2**20:.1f} MiB in {len(stats_list)} shard(s), "
+          f"{st['bits'] / max(1, count // len(stats_list)):.1f} bits/password, {st['hashes']} hashes, "
+          f"target false-positive rate {st['fp_rate']:g}", file=sys.stderr)
+    print(f"unique: {rejected:,} candidates regenerated "
+          f"(false-positive budget: ~{expected:,.1f} expected)", file=sys.stderr)
+
+
+def legacy_password():
+    """One password the way the interactive prompt used to build it (for comparison)."""
+    return "".join(
+        "".join(secrets.choice(string.ascii_letters) for _ in range(2))
+        + "".join(secrets.choice(sym) for _ in range(2))
+        + str(10 + secrets.randbelow(90))
+        for sym in (symbol1, symbol2, symbol3, symbol4)
+    )
 
-while True:
-    print( )
-    antal = int (input ("How many passwords do you want?: "))
 
-    for i in range (0,antal):
+def benchmark(count, batch):
+    class Sink:
+        written = 0
 
-        password1 = "".join(random.choices((string.ascii_letters), k=2))
+        def write(self, data):
+            self.written += len(data)
 
-        password2 = "".join(random.choices((string.ascii_letters), k=2))
-	
-        password3 = "".join(random.choices((string.ascii_letters), k=2))
+        def flush(self):
+            pass
 
-        password4 = "".join(random.choices((string.ascii_letters), k=2))
+    sink = Sink()
+    t0 = time.perf_counter()
+    generate(count, sink, batch)
+    elapsed = time.perf_counter() - t0
+    print(f"batched : {count:,} passwords in {elapsed:.2f}s "
+          f"({count / elapsed:,.0f}/s, {sink.written / elapsed / 1e6:.1f} MB/s)")
 
-        random_symbols1 = "".join(secrets.choice(symbol1) for _ in range(2))
+    sample = min(count, 20000)
+    t0 = time.perf_counter()
+    for _ in range(sample):
+        legacy_password()
+    legacy = time.perf_counter() - t0
+    print(f"per-char: {sample:,} passwords in {legacy:.2f}s ({sample / legacy:,.0f}/s)")
+    print(f"speed-up: {(count / elapsed) / (sample / legacy):.0f}x")
 
-        random_symbols2 = "".join(secrets.choice(symbol2) for _ in range(2))
 
-        random_symbols3 = "".join(secrets.choice(symbol3) for _ in range(2))
+def interactive():
+    while True:
+        print( )
+        antal = int (input ("How many passwords do you want?: "))
+        generate(antal, sys.stdout.buffer)
 
-        random_symbols4 = "".join(secrets.choice(symbol4) for _ in range(2))
 
-        nr1 = random.randint (10,99)
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate passwords from a CSPRNG. Without arguments, asks interactively.")
+    parser.add_argument("-n", "--count", type=int, help="Number of passwords to generate")
+    parser.add_argument("-o", "--output", help="Write to this file instead of stdout")
+    parser.add_argument("--batch", type=int, default=DEFAULT_BATCH,
+                        help=f"Passwords generated per batch (default: {DEFAULT_BATCH})")
+    parser.add_argument("-u", "--unique", action="store_true",
+                        help="Guarantee no password is repeated (memory-bounded Bloom filter)")
+    parser.add_argument("--fp-rate", type=float, default=1e-6,
+                        help="Bloom filter false-positive rate for --unique (default: 1e-6)")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Generate in N processes into OUTPUT-001 ... OUTPUT-N (needs -o)")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=1000000, metavar="N",
+                        help="Measure throughput for N passwords (default: 1000000)")
+    args = parser.parse_args()
 
-        nr2 = random.randint (10,99)
+    if args.jobs > 1 and not args.output:
+        parser.error("--jobs needs --output")
+    if not 0 < args.fp_rate < 1:
+        parser.error("--fp-rate must be between 0 and 1")
+    fp_rate = args.fp_rate if args.unique else None
 
-        nr3 = random.randint (10,99)
+    if args.benchmark:
+        benchmark(args.benchmark, args.batch)
+    elif args.count is None:
+        interactive()
+    elif args.jobs > 1:
+        t0 = time.perf_counter()
+        paths, stats = generate_sharded(args.count, args.output, args.jobs, fp_rate, args.batch)
+        report(stats, time.perf_counter() - t0)
+        print(f"written: {paths[0]} ... {paths[-1]}", file=sys.stderr)
+    else:
+        t0 = time.perf_counter()
+        with (open(args.output, "wb") if args.output else os.fdopen(os.dup(1), "wb")) as f:
+            if fp_rate:
+                stats = generate_unique(args.count, f, fp_rate, args.batch)
+            else:
+                generate(args.count, f, args.batch)
+                stats = {"count": args.count}
+        if args.output or fp_rate:
+            report([stats], time.perf_counter() - t0)
 
-        nr4 = random.randint (10,99)
 
-        result = password1 + random_symbols1 + str(nr1) + password2 + random_symbols2 + str(nr2) + password3 + random_symbols3 + str(nr3) + password4 + random_symbols4 + str(nr4)
-        
-        print(result)
+if __name__ == "__main__":
+    try:
+        main()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
@@ -0,0 +1,33 @@
+"""Load the hyphenated top-level scripts as importable modules."""
+import os
+import sys
+import importlib.util
+
+import pytest
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_script(name, filename):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module      # multiprocessing pickles functions by module name
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture(scope="session")
+def lsb():
+    return load_script("live_system_builder", "Live-System-Builder-CLI.py")
+
+
+@pytest.fixture(scope="session")
+def ddcli():
+    return load_script("dd_cli", "DD-CLI.py")
+
+
+@pytest.fixture(scope="session")
+def pwgen():
+    return load_script("password_generator", "password-generator.py")
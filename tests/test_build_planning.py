@@ -0,0 +1,81 @@
+import os
+import glob
+
+import pytest
+
+
+@pytest.fixture(scope="module")
+def synthetic_tree(lsb, tmp_path_factory):
+    root = str(tmp_path_factory.mktemp("rootfs"))
+    lsb.make_synthetic_root(root, dict(files=400, file_size=4096, big_files=3, big_size=2 * 1024**2,
+                                       hardlinks=40, xattrs=0, dirs=30))
+    return root
+
+
+def check_plan(lsb, sizes, dirs, count, cap):
+    modules = lsb.plan_modules(sizes, dirs, count, cap)
+    units = [u for m in modules for u in m["units"]]
+    assert modules[0]["units"][0] == ""
+    assert len(units) == len(set(units))
+    assert set(units) <= set(sizes)
+    # Units are disjoint slices of the tree, so the module sizes add up to it
+    assert sum(m["size"] for m in modules) == sizes[""]
+    for m in modules:
+        assert m["size"] <= cap or len(m["units"]) == 1
+    return modules
+
+
+def test_tree_sizes_counts_hardlinks_once(lsb, synthetic_tree):
+    sizes, dirs = lsb.tree_sizes(synthetic_tree)
+    links = glob.glob(f"{synthetic_tree}/**/*.link*", recursive=True)
+    assert len(links) == 40
+    assert sizes[""] == lsb.tree_size(synthetic_tree)[1] - sum(map(os.path.getsize, links))
+    assert {"usr", "usr/lib", "usr/lib/bench", "etc"} <= dirs
+    assert sizes["usr/lib/bench/big000.so"] == 2 * 1024**2
+
+
+def test_plan_modules_single(lsb, synthetic_tree):
+    sizes, dirs = lsb.tree_sizes(synthetic_tree)
+    assert check_plan(lsb, sizes, dirs, 1, 1 << 40) == [{"units": [""], "size": sizes[""]}]
+
+
+@pytest.mark.parametrize("count", [2, 4, 8])
+def test_plan_modules_spreads_the_tree(lsb, synthetic_tree, count):
+    sizes, dirs = lsb.tree_sizes(synthetic_tree)
+    modules = check_plan(lsb, sizes, dirs, count, 1 << 40)
+    assert len(modules) == count
+    # Longest-processing-time packing: modules differ by at most the biggest
+    # unit, here the 8 MiB kernel image
+    assert max(m["size"] for m in modules) - min(m["size"] for m in modules) <= 8 * 1024**2
+
+
+def test_plan_modules_respects_the_cap(lsb, synthetic_tree):
+    sizes, dirs = lsb.tree_sizes(synthetic_tree)
+    cap = sizes[""] // 5
+    modules = check_plan(lsb, sizes, dirs, 1, cap)
+    assert len(modules) >= 5
+
+
+def test_parse_access_log(lsb):
+    log = [
+        "# fatrace -t",
+        "bash(1234): RO /usr/bin/ls",
+        "ls(1240): O /usr/lib/x86_64-linux-gnu/libc.so.6",
+        'openat(AT_FDCWD, "/etc/ld.so.cache", O_RDONLY|O_CLOEXEC) = 3',
+        'openat(AT_FDCWD, "/etc/missing.conf", O_RDONLY) = -1 ENOENT (No such file or directory)',
+        'execve("/usr/bin/ls", ["ls"], 0x7ffd /* 20 vars */) = 0',
+        "systemd(1): RO /run/live/rootfs/filesystem.squashfs/usr/lib/systemd/systemd",
+        "cat(99): R /proc/cpuinfo",
+        "/usr/share/fonts/../fonts/DejaVuSans.ttf",
+        "/tmp/scratch",
+        "/usr/bin/gone (deleted)",
+        "not a path",
+        "",
+    ]
+    assert lsb.parse_access_log(log) == [
+        "/usr/bin/ls",
+        "/usr/lib/x86_64-linux-gnu/libc.so.6",
+        "/etc/ld.so.cache",
+        "/usr/lib/systemd/systemd",
+        "/usr/share/fonts/DejaVuSans.ttf",
+    ]
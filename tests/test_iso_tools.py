@@ -0,0 +1,175 @@
+import os
+import mmap
+import shutil
+import struct
+import hashlib
+
+import pytest
+
+GRUB_CFG = """set default=0
+set timeout=10
+
+menuentry "Glitch - Live" {
+    linux /live/vmlinuz boot=live components quiet splash
+    initrd /live/initrd.img
+}
+menuentry 'Glitch - Live (safe graphics)' {
+    linux /live/vmlinuz boot=live components quiet splash nomodeset vga=791
+    initrd /live/initrd.img
+}
+"""
+
+
+def superblock(**fields):
+    """A squashfs 4.0 superblock with sane defaults; fields override them."""
+    sb = dict(magic=0x73717368, inodes=1200, mkfs_time=0, block_size=1 << 17, fragments=3,
+              compressor=4, block_log=17, flags=0, ids=1, major=4, minor=0, root=0,
+              bytes_used=1 << 20, id=1000, xattr=0xFFFFFFFFFFFFFFFF, inode=2000,
+              directory=3000, fragment=4000, export=0xFFFFFFFFFFFFFFFF)
+    sb.update(fields)
+    return struct.pack("<IIIIIHHHHHHQQQQQQQQ", *sb.values())
+
+
+def test_squashfs_superblock_ok(lsb):
+    errors, info = lsb.check_squashfs_superblock(superblock(), 1 << 21)
+    assert errors == []
+    assert info == {"version": "4.0", "compressor": "xz", "block_size": 1 << 17,
+                    "bytes_used": 1 << 20, "inodes": 1200}
+
+
+@pytest.mark.parametrize("fields, available, message", [
+    (dict(magic=0x1234), None, "bad magic"),
+    (dict(major=3, minor=1), None, "unsupported version 3.1"),
+    (dict(compressor=9), None, "unknown compressor id 9"),
+    (dict(block_log=16), None, "bad block size"),
+    (dict(block_size=1 << 21, block_log=21), None, "bad block size"),
+    ({}, 1000, "exceeds file size"),
+    (dict(fragment=1 << 21), None, "fragment table"),
+])
+def test_squashfs_superblock_errors(lsb, fields, available, message):
+    errors, _ = lsb.check_squashfs_superblock(superblock(**fields), available)
+    assert any(message in e for e in errors), errors
+
+
+def test_squashfs_superblock_truncated(lsb):
+    assert lsb.check_squashfs_superblock(superblock()[:60]) == (["squashfs: bad magic"], {})
+
+
+def test_rebrand_grub_cfg(lsb):
+    text = lsb.rebrand_grub_cfg(GRUB_CFG, system_name="Nova 2", append=("toram", "quiet"),
+                                remove=("splash", "vga="), timeout=3, default=1)
+    assert 'menuentry "Nova 2 - Live" {' in text
+    assert "menuentry 'Nova 2 - Live (safe graphics)' {" in text
+    assert "    linux /live/vmlinuz boot=live components quiet toram\n" in text
+    assert "    linux /live/vmlinuz boot=live components quiet nomodeset toram\n" in text
+    assert "set timeout=3\n" in text and "set default=1\n" in text
+    assert "initrd /live/initrd.img" in text
+    assert lsb.rebrand_grub_cfg(GRUB_CFG) == GRUB_CFG
+
+
+def copy_mapped(ddcli, image, bmap, out):
+    """Write only the bmap's ranges into a fresh file, checking each range."""
+    size, algo, ranges = ddcli.load_bmap(bmap)
+    with open(image, 'rb') as src, open(out, 'wb') as dst:
+        dst.truncate(size)
+        for start, end, checksum in ranges:
+            src.seek(start)
+            data = src.read(end - start)
+            assert hashlib.new(algo, data).hexdigest() == checksum
+            dst.seek(start)
+            dst.write(data)
+    return size, ranges
+
+
+def same_file(a, b):
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+
+def test_bmap_round_trip_sparse_file(lsb, ddcli, tmp_path):
+    image = str(tmp_path / "disk.img")
+    with open(image, 'wb') as f:
+        f.truncate(4 * 1024**2 + 1000)
+        for offset in (0, 65536, 2 * 1024**2 + 100, 4 * 1024**2 + 10):
+            f.seek(offset)
+            f.write(os.urandom(900))
+    mapped, size = lsb.write_bmap(image)
+    assert size == os.path.getsize(image)
+    out = str(tmp_path / "copy.img")
+    _, ranges = copy_mapped(ddcli, image, image + ".bmap", out)
+    assert same_file(image, out)
+    if mapped < size // 2:          # only where the filesystem reports holes
+        assert [start // lsb.BMAP_BLOCK for start, _, _ in ranges] == [0, 16, 512, 1024]
+        assert mapped == 4 * lsb.BMAP_BLOCK
+
+
+def test_bmap_rejects_edited_file(lsb, ddcli, tmp_path):
+    image = str(tmp_path / "disk.img")
+    with open(image, 'wb') as f:
+        f.write(os.urandom(10000))
+    lsb.write_bmap(image)
+    with open(image + ".bmap") as f:
+        text = f.read()
+    with open(image + ".bmap", 'w') as f:
+        f.write(text.replace("<ImageSize> 10000 </ImageSize>", "<ImageSize> 10001 </ImageSize>"))
+    with pytest.raises(ValueError, match="checksum mismatch"):
+        ddcli.load_bmap(image + ".bmap")
+
+
+@pytest.fixture(scope="module")
+def fixture_iso(lsb, tmp_path_factory):
+    """A data ISO of a small synthetic tree, built as the bench does it."""
+    if not shutil.which("xorriso"):
+        pytest.skip("xorriso not installed")
+    work = tmp_path_factory.mktemp("iso")
+    root = str(work / "iso-root")
+    lsb.make_synthetic_root(os.path.join(root, "live", "root"), dict(
+        files=200, file_size=4096, big_files=1, big_size=1024**2, hardlinks=0, xattrs=0, dirs=10))
+    os.makedirs(os.path.join(root, "boot", "grub"))
+    with open(os.path.join(root, "boot", "grub", "grub.cfg"), 'w') as f:
+        f.write(GRUB_CFG)
+    iso = str(work / "fixture.iso")
+    lsb._bench_iso(root, iso)
+    return iso
+
+
+def read_iso_file(lsb, iso, path):
+    with open(iso, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        extent, size = lsb._iso_files(mm)[path]
+        return mm[extent * lsb.ISO_SECTOR:extent * lsb.ISO_SECTOR + size]
+
+
+def test_rebrand_then_verify(lsb, fixture_iso, tmp_path):
+    iso = str(tmp_path / "rebrand.iso")
+    shutil.copyfile(fixture_iso, iso)
+    before, _ = lsb.verify_iso(iso)
+
+    edit = lambda old: lsb.rebrand_grub_cfg(old.decode(), system_name="Nova", append=("toram",)).encode()
+    plan = lsb.rebrand_iso(iso, {"boot/grub/grub.cfg": edit}, volume="NOVA-LIVE")
+    assert [(p, how) for p, _, _, how in plan] == [("boot/grub/grub.cfg", "in place")]
+
+    after, info = lsb.verify_iso(iso)
+    assert after == before          # a data ISO lacks the boot files, but nothing new broke
+    assert info["volume_id"] == "NOVA-LIVE"
+    cfg = read_iso_file(lsb, iso, "/boot/grub/grub.cfg").decode()
+    assert cfg == edit(GRUB_CFG.encode()).decode()
+    assert read_iso_file(lsb, iso, "/live/root/etc/passwd") == read_iso_file(lsb, fixture_iso, "/live/root/etc/passwd")
+
+
+def test_rebrand_refuses_missing_files(lsb, fixture_iso, tmp_path):
+    iso = str(tmp_path / "rebrand.iso")
+    shutil.copyfile(fixture_iso, iso)
+    with pytest.raises(ValueError, match="not in the image"):
+        lsb.rebrand_iso(iso, {"boot/grub/theme.cfg": b"title-text: \"\"\n"})
+    assert same_file(iso, fixture_iso)
+
+
+def test_bmap_round_trip_iso(lsb, ddcli, fixture_iso, tmp_path):
+    iso = str(tmp_path / "bmap.iso")
+    shutil.copyfile(fixture_iso, iso)
+    mapped, size = lsb.write_bmap(iso)
+    assert mapped <= size
+    copy = str(tmp_path / "copy.iso")
+    copy_mapped(ddcli, iso, iso + ".bmap", copy)
+    # Blocks left out are zero padding, so a zeroed target ends up identical
+    assert same_file(iso, copy)
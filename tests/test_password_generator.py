@@ -0,0 +1,55 @@
+import io
+import re
+
+
+def password_re(pwgen):
+    symbols = [re.escape(s) for s in (pwgen.symbol1, pwgen.symbol2, pwgen.symbol3, pwgen.symbol4)]
+    return re.compile("".join(f"[A-Za-z]{{2}}[{s}]{{2}}[1-9][0-9]" for s in symbols))
+
+
+def test_generate_batch_layout(pwgen):
+    data = pwgen.generate_batch(2000)
+    assert len(data) == 2000 * pwgen.RECORD
+    lines = data.decode(pwgen.CHARSET).split("\n")
+    assert lines.pop() == ""
+    pattern = password_re(pwgen)
+    assert len(lines) == 2000
+    assert all(len(pw) == pwgen.LENGTH and pattern.fullmatch(pw) for pw in lines)
+
+
+def test_bloom_filter_has_no_false_negatives(pwgen):
+    bloom = pwgen.BloomFilter(5000, 1e-9)
+    items = [i.to_bytes(4, "little") for i in range(5000)]
+    assert all(bloom.add(item) for item in items)
+    assert not any(bloom.add(item) for item in items)
+    assert bloom.count == 5000
+
+
+def test_bloom_filter_sizing(pwgen):
+    bloom = pwgen.BloomFilter(100000, 1e-6)
+    # ~28.8 bits and 20 hashes per item for a one-in-a-million false positive rate
+    assert 28 * 100000 < bloom.m < 29 * 100000
+    assert bloom.k == 20
+    assert bloom.expected_false_positives() < 1
+
+
+def test_generate_unique_writes_no_duplicates(pwgen):
+    out = io.BytesIO()
+    stats = pwgen.generate_unique(20000, out, fp_rate=1e-6, batch=3000)
+    lines = out.getvalue().decode("utf-8").split("\n")
+    assert lines.pop() == ""
+    assert len(lines) == stats["count"] == 20000
+    assert len(set(lines)) == 20000
+
+
+def test_generate_sharded_outputs_are_disjoint(pwgen, tmp_path):
+    paths, stats = pwgen.generate_sharded(3001, str(tmp_path / "pw.txt"), 3, fp_rate=1e-6, batch=500)
+    assert [p.rsplit("/", 1)[1] for p in paths] == ["pw-001.txt", "pw-002.txt", "pw-003.txt"]
+    seen = set()
+    for path, st in zip(paths, stats):
+        with open(path, encoding="utf-8") as f:
+            lines = f.read().splitlines()
+        assert len(lines) == st["count"]
+        assert seen.isdisjoint(lines)
+        seen.update(lines)
+    assert len(seen) == 3001